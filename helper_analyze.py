@@ -1,11 +1,17 @@
-import json
 import re
+import string
 
+import numpy as np
 import pandas as pd
 from rich.console import Console
 
 console = Console()
 
+# Deletion table for every ASCII character that is not a letter or digit
+_KEY_CHARS = frozenset(string.ascii_letters + string.digits)
+_KEY_TRANS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if chr(c) not in _KEY_CHARS))
+_KEY_RE = re.compile(r'[^A-Za-z0-9]')
+
 
 def add_overall_percentage(df: pd.DataFrame):
     """
@@ -25,27 +31,50 @@ def add_overall_percentage(df: pd.DataFrame):
         print("Input DataFrame is empty. Cannot calculate overall percentage.")
         return pd.DataFrame()
 
-    df_with_overall = df.copy() # Work on a copy to avoid modifying the original DataFrame
+    # Shallow copy: shares the existing column buffers, only the new column allocates
+    df_with_overall = df.copy(deep=False)
 
     # Identify columns that contain '%' in their name (case-insensitive)
     # These are assumed to be the percentage columns to average.
-    percentage_columns = df_with_overall.filter(regex=r'(?i)%')
+    percentage_cols = [c for c in df_with_overall.columns if "%" in str(c)]
 
-    if percentage_columns.empty:
+    if not percentage_cols:
         print("No percentage columns found (columns with '%' in their name).")
         # You might want to return the original DataFrame or raise an error here
         return df_with_overall
 
-    # Calculate the mean across rows (axis=1) for the identified percentage columns.
-    # This computes the overall percentage for each student.
-    df_with_overall['OVERALL%'] = percentage_columns.mean(axis=1)
-
-    # Round the overall percentage to two decimal places for readability
-    df_with_overall['OVERALL%'] = df_with_overall['OVERALL%'].round(2)
+    # Compute the overall percentage for each student as a single NumPy reduction
+    # over the percentage block, rounded to two decimal places for readability.
+    arr = df_with_overall[percentage_cols].to_numpy(dtype=np.float64)
+    df_with_overall['OVERALL%'] = np.round(arr.mean(axis=1), 2)
 
     return df_with_overall, "OVERALL%"
 
 
+def _student_rows(names: np.ndarray) -> np.ndarray:
+    """Returns a boolean mask of the rows whose name does not contain "Total" (case-insensitive)."""
+
+    return np.char.find(np.char.lower(names.astype(str)), 'total') < 0
+
+
+def _normalize_block(mat: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    """
+    Scales the fraction columns (all values below 1) of a 2D float array by
+    100 and rounds everything to two decimals, in place.
+
+    Uses one min/max reduction over the whole block and broadcast ufuncs
+    instead of a Python loop per column. If a boolean `rows` mask is given,
+    only those rows decide which columns are fractions (all rows are still
+    scaled). `mat` must have at least one row.
+    """
+    sample = mat[rows] if rows is not None and rows.any() else mat
+    col_min = np.nanmin(sample, axis=0)
+    col_max = np.nanmax(sample, axis=0)
+    np.multiply(mat, np.where((col_min < 1) & (col_max < 1), 100.0, 1.0), out=mat)
+    np.round(mat, 2, out=mat)
+    return mat
+
+
 def normalize_columns_to_1_100(df: pd.DataFrame) -> pd.DataFrame:
     """
     Normalizes all numeric columns in a DataFrame to a range of 1 to 100.
@@ -56,34 +85,71 @@ def normalize_columns_to_1_100(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: A new DataFrame with normalized values.
     """
-    # Create a copy to avoid modifying the original DataFrame
-    df_normalized = df.copy()
-
-    # Get a list of all numeric columns
-    numeric_cols = df_normalized.select_dtypes(include=['number']).columns
-
-    for col in numeric_cols:
-        col_min = df_normalized[col].min()
-        col_max = df_normalized[col].max()
-        if (col_min < 1 and col_max < 1):
-            df_normalized[col] = round(df_normalized[col] * 100, 2)
-        else:
-            df_normalized[col] = round(df_normalized[col], 2)
-
-        # # Handle the case where all values in the column vare the same (range is 0)
-        # if col_max == col_min:
-        #     # If all values are the same, they should all map to the middle of the new range
-        #     df_normalized[col] = 50.5
-        # else:
-        #     # df_normalized[col] = ((df_normalized[col] - col_min) / (col_max - col_min)) * 99 + 1
+    # Shallow copy: untouched columns keep sharing buffers with the original,
+    # normalized columns are replaced (never written in place) below
+    df_normalized = df.copy(deep=False)
+
+    # Integer columns are left as they are: rounding does not change them and
+    # a whole-number column is never a 0-1 fraction that needs scaling.
+    num_cols = df_normalized.select_dtypes(include=['floating']).columns
+    if num_cols.empty or df_normalized.empty:
+        return df_normalized
+
+    mat = _normalize_block(df_normalized[num_cols].to_numpy(dtype=np.float64, copy=True))
+    for j, col in enumerate(num_cols):
+        df_normalized[col] = mat[:, j]
 
     return df_normalized
 
+def normalize_and_add_overall(df: pd.DataFrame):
+    """
+    Normalizes the percentage columns to a range of 1 to 100 and adds the
+    'OVERALL%' column, reading the percentage block only once.
+
+    Fuses normalize_columns_to_1_100 and add_overall_percentage for frames
+    whose numeric columns are the percentage columns, as built in process_file.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame with a student name column and
+                           percentage columns ('%' in their name).
+
+    Returns:
+        tuple: The new DataFrame and the name of the overall column ("OVERALL%").
+
+    Raises:
+        ValueError: If the DataFrame is empty or has no percentage columns.
+    """
+    percentage_cols = [c for c in df.columns if "%" in str(c)]
+    if df.empty:
+        raise ValueError("No attendance rows found in the sheet.")
+    if not percentage_cols:
+        raise ValueError("No percentage columns ('%' in the header) found in the sheet.")
+
+    # Decide the scale from the student rows only, so a Total row holding 1 (100%)
+    # in a column of fractions does not stop that column from being scaled.
+    # This keeps the result valid for get_low_attendance_students(already_normalized=True).
+    student_rows = _student_rows(df[df.columns[0]].to_numpy())
+    mat = _normalize_block(df[percentage_cols].to_numpy(dtype=np.float64, copy=True), student_rows)
+
+    # Shallow copy; only the normalized float columns and the new column allocate.
+    # Integer columns are left as they are, as in normalize_columns_to_1_100.
+    df_with_overall = df.copy(deep=False)
+    for j, col in enumerate(percentage_cols):
+        if pd.api.types.is_float_dtype(df_with_overall[col]):
+            df_with_overall[col] = mat[:, j]
+    df_with_overall['OVERALL%'] = np.round(mat.mean(axis=1), 2)
+
+    return df_with_overall, "OVERALL%"
+
+
 def clean_key(key: str) -> str:
-    return re.sub(r'[^A-Za-z0-9]', '', str(key))
+    key = str(key)
+    if key.isascii():
+        return key.translate(_KEY_TRANS)
+    return _KEY_RE.sub('', key)
 
 
-def get_low_attendance_students(df: pd.DataFrame, min_percentage: float):
+def get_low_attendance_students(df: pd.DataFrame, min_percentage: float, already_normalized: bool = False):
     """
     Extracts names of students and their percentages with attendance
     less than min_percentage for each percentage column.
@@ -93,58 +159,63 @@ def get_low_attendance_students(df: pd.DataFrame, min_percentage: float):
                            student names, and other columns with '%' are
                            assumed to be attendance percentages.
         min_percentage (float): The minimum required attendance percentage.
+        already_normalized (bool): Skip normalization when the percentage
+                                   columns are already on the 1-100 scale.
 
     Returns:
-        str: A JSON string with column names as keys and a nested JSON object
-             (student names as keys, percentages as values) as values.
+        tuple: A dict with cleaned column names as keys and a nested dict
+               (student names as keys, percentages as values) as values,
+               the list of those column keys, and a status string
+               ("success" or an error description).
     """
     try:
         subjects = []
         if df.empty:
-            return json.dumps({}), subjects, "Empty Dataframe"
+            return {}, subjects, "Empty Dataframe"
 
         # Assuming the first column is always the student name
         student_name_column = df.columns[0]
 
         # Remove the Total classes row
-        # Create a boolean mask to identify rows where the first column
-        # is NOT equal to "Total" (case-sensitive)
-        mask = ~df[student_name_column].str.contains('Total', case=False, na=False)
+        # Create a boolean mask to identify rows where the first column does
+        # NOT contain "Total" (case-insensitive, plain substring match)
+        names = df[student_name_column].to_numpy()
+        mask = _student_rows(names)
+
+        # Identify percentage columns, skipping any that are not numeric
+        percentage_columns = []
+        for col in [c for c in df.columns if "%" in str(c) and c != student_name_column]:
+            if pd.api.types.is_numeric_dtype(df[col]):
+                percentage_columns.append(col)
+            else:
+                print(f"Warning: Column '{col}' is not numeric and will be skipped.")
 
-        # Use the mask to filter the DataFrame
-        df = df[mask]
+        subjects = [clean_key(col) for col in percentage_columns]
+        low_attendance_summary = {subject: {} for subject in subjects}
 
-        # Identify percentage columns (case-insensitive for '%')
-        # Normalize the numeric columns
-        df = normalize_columns_to_1_100(df)
-        percentage_columns = df.filter(regex=r'(?i)%').columns.tolist()
-        if student_name_column in percentage_columns:
-            percentage_columns.remove(student_name_column)
+        # Percentages are never negative, so nobody can be below a threshold <= 0
+        if min_percentage <= 0:
+            return low_attendance_summary, subjects, "success"
 
-        low_attendance_summary = {}
+        # Extract the student names and the percentage block once, dropping the
+        # Total row, then normalize and threshold the same buffer in one pass
+        names = names[mask]
+        mat = df[percentage_columns].to_numpy(dtype=np.float64)[mask]
+        if len(mat) and not already_normalized:
+            _normalize_block(mat)
+        below = mat < min_percentage
 
-        # Iterate through each identified percentage column
-        for col in percentage_columns:
-            if pd.api.types.is_numeric_dtype(df[col]):
-                # Filter rows where attendance is less than the min percentage
-                low_attendance_df = df[df[col] < min_percentage]
-
-                # Create a dictionary for the current subject
-                subject_summary = {}
-                for _, row in low_attendance_df.iterrows():
-                    student_name = row[student_name_column]
-                    percentage = row[col]
-                    # Populate the inner dictionary
-                    subject_summary[student_name] = percentage
-
-                # Add the subject's dictionary to the main summary
-                col = clean_key(col)
-                subjects.append(col)
-                low_attendance_summary[col] = subject_summary
-            else:
-                print(f"Warning: Column '{col}' is not numeric and will be skipped.")
+        # Common case for a well-attending class: nobody is below the threshold
+        if not below.any():
+            return low_attendance_summary, subjects, "success"
+
+        # Only subjects with at least one student below the threshold need work
+        for j in np.flatnonzero(below.any(axis=0)):
+            # Build the {student name: percentage} dict from the selected rows
+            rows = np.flatnonzero(below[:, j])
+            low_attendance_summary[subjects[j]] = dict(zip(names[rows].tolist(), mat[rows, j].tolist()))
 
-        return json.dumps(low_attendance_summary, indent=4), subjects, "success"
+        return low_attendance_summary, subjects, "success"
     except Exception as e:
         console.print(f"Error in finding low attendance students : {e}", style="bold red")
-        return json.dumps({}), subjects, "Failed to find low attendance students"
+        return {}, subjects, "Failed to find low attendance students"
@@ -0,0 +1,107 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+
+def _convert_cell(cell):
+    """Converts an openpyxl cell value the same way pandas' openpyxl reader does."""
+
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+        return float(cell.value)
+    return cell.value
+
+
+def read_sheet_rows(file_path) -> list[list]:
+    """
+    Parses the first worksheet of an Excel file once into a list of rows.
+
+    Cells are converted, and trailing empty cells/rows trimmed, exactly as
+    pd.read_excel does, so the rows can be turned into DataFrames with
+    different header settings without parsing the file again.
+
+    Args:
+        file_path: Path to the .xlsx file.
+
+    Returns:
+        list[list]: One list per sheet row, all padded to the same width.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+
+        rows = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.rows):
+            converted_row = [_convert_cell(cell) for cell in row]
+            while converted_row and converted_row[-1] == "":
+                # trim trailing empty elements
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            rows.append(converted_row)
+    finally:
+        workbook.close()
+
+    # Trim trailing empty rows and extend the rest to the max width
+    rows = rows[: last_row_with_data + 1]
+    if rows:
+        max_width = max(len(row) for row in rows)
+        rows = [row + [""] * (max_width - len(row)) for row in rows]
+    return rows
+
+
+def _fill_mi_header(row, control_row):
+    """Forward fills blank header cells inside the same parent header, as pandas does for MultiIndex headers."""
+
+    last = row[0]
+    for i in range(1, len(row)):
+        if not control_row[i]:
+            last = row[i]
+
+        if row[i] == "" or row[i] is None:
+            row[i] = last
+        else:
+            control_row[i] = False
+            last = row[i]
+
+    return row, control_row
+
+
+def rows_to_dataframe(rows: list[list], header=0) -> pd.DataFrame:
+    """
+    Builds a DataFrame from rows returned by read_sheet_rows, equivalent to
+    calling pd.read_excel(file_path, header=header) on the same sheet.
+
+    Args:
+        rows (list[list]): Sheet rows from read_sheet_rows. Not modified.
+        header (int | list[int]): Row position(s) to use as column labels.
+
+    Returns:
+        pd.DataFrame: The parsed DataFrame.
+    """
+    if not rows:
+        return pd.DataFrame()
+
+    if isinstance(header, list) and len(header) == 1:
+        header = header[0]
+
+    data = list(rows)
+    if isinstance(header, list):
+        # Forward fill merged header cells on copies of the header rows
+        control_row = [True] * len(data[0])
+        for row in header:
+            if row > len(data) - 1:
+                raise ValueError(f"header index {row} exceeds maximum index {len(data) - 1} of data.")
+            data[row], control_row = _fill_mi_header(list(data[row]), control_row)
+
+    return TextParser(data, header=header, skip_blank_lines=False).read()
@@ -1,65 +1,129 @@
 #!/usr/bin/env python3
 
-import json
+import dbm
+import hashlib
+import logging
+import shelve
+import threading
+import time
+from dataclasses import dataclass, field
 
 import gradio as gr
+import numpy as np
 import pandas as pd
 from pandas.errors import EmptyDataError
 from rich.console import Console
 
-# from helper import get_header_info, summarize_attendance_sheet_with_gemini
-from helper import get_header_info
-from helper_analyze import (add_overall_percentage,
-                            get_low_attendance_students,
-                            normalize_columns_to_1_100)
+from helper import HEADER_SAMPLE_ROWS, get_header_info, get_prompt_initial
+from helper_analyze import (get_low_attendance_students,
+                            normalize_and_add_overall)
+from helper_excel import read_sheet_rows, rows_to_dataframe
 
 # Global variables
-uploaded_df = None
-subject_names = []
-header_rows = []
-subject_row = 0 
-response_data = ""
-summarization = {}
+HEADER_INFO_CACHE_PATH = ".gemini_cache"  # on-disk store: file hash -> (stored at, parsed Gemini header info)
+HEADER_INFO_CACHE_TTL = 24 * 3600  # seconds; after this a re-upload asks Gemini again
+header_info_lock = threading.Lock()
+PREVIEW_ROWS = 200  # rows sent to the browser for the preview table
 console = Console()
+log = logging.getLogger(__name__)
 
-def column_rename(column_name):
-    if isinstance(column_name, tuple):
-        return "-".join([word for i, word in enumerate(column_name) if "Unnamed" not in word])
-    return str(column_name)
+@dataclass
+class Session:
+    """Per-user analysis state, kept in gr.State so concurrent uploads don't clobber each other."""
+
+    df: pd.DataFrame | None = None
+    subjects: list = field(default_factory=list)
+    summary: dict = field(default_factory=dict)
+
+def file_digest(file_path):
+    """
+    Returns a SHA-256 key for the file content, used to recognise re-uploads.
+    The prompt instructions are folded in so editing the prompt invalidates old entries.
+    """
+
+    with open(file_path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256")
+    digest.update(get_prompt_initial("").encode())
+    return digest.hexdigest()
+
+def _is_fresh(entry, now):
+    """True for a (stored at, header info) entry younger than HEADER_INFO_CACHE_TTL."""
+    return isinstance(entry, tuple) and len(entry) == 2 and now - entry[0] < HEADER_INFO_CACHE_TTL
+
+def get_cached_header_info(file_hash):
+    """Returns the header info stored for this file hash, or None if absent, expired or unreadable."""
+    try:
+        with header_info_lock, shelve.open(HEADER_INFO_CACHE_PATH) as cache:
+            entry = cache.get(file_hash)
+            if entry is None:
+                return None
+            if not _is_fresh(entry, time.time()):
+                del cache[file_hash]
+                return None
+            return entry[1]
+    except (OSError, *dbm.error) as e:
+        console.print(f"Could not read header info cache: {e}", style="yellow")
+        return None
+
+def store_header_info(file_hash, header_info):
+    """
+    Persists parsed header info so re-uploads skip Gemini for HEADER_INFO_CACHE_TTL,
+    also across restarts. Expired entries are dropped on each write. Best effort.
+    """
+    now = time.time()
+    try:
+        with header_info_lock, shelve.open(HEADER_INFO_CACHE_PATH) as cache:
+            for key in [k for k in cache if not _is_fresh(cache[k], now)]:
+                del cache[key]
+            cache[file_hash] = (now, header_info)
+    except (OSError, *dbm.error) as e:
+        console.print(f"Could not write header info cache: {e}", style="yellow")
+
+def rename_columns(columns):
+    """Flattens (MultiIndex) column labels to "level-level" strings, dropping "Unnamed" placeholders."""
+
+    if not isinstance(columns, pd.MultiIndex):
+        return [str(c) for c in columns]
+    # Test each unique level value for "Unnamed" once, then expand through the codes.
+    # A trailing "" sentinel makes code -1 (a missing value, e.g. an Excel error cell)
+    # an empty part instead of wrapping round to the last level value.
+    levels = [lvl.astype(str) for lvl in columns.levels]
+    levels = [np.append(np.where(lvl.str.contains("Unnamed", regex=False), "", lvl), "") for lvl in levels]
+    parts = [lvl[codes] for lvl, codes in zip(levels, columns.codes)]
+    return ["-".join(word for word in col if word) for col in zip(*parts)]
+
+def process_file(file_obj, min_percentage, session):
 
-def process_file(file_obj, min_percentage):
-    global uploaded_df, subject_names, summarization
-    
-    print("*"*100)
     if file_obj is None:
-        return pd.DataFrame({"Error": ["No file uploaded."]}), gr.update(choices=[])
+        return pd.DataFrame({"Error": ["No file uploaded."]}), gr.update(choices=[]), session
 
     file_path = file_obj.name
     try:
-        # First read to get subject names and header info
+        # Parse the workbook once; both DataFrames below are built from these rows
+        # First frame (default header) to get subject names and header info; the
+        # headers sit at the top, so only the rows Gemini is shown need to be turned into it
         try:
-            df_initial = pd.read_excel(file_path)
+            rows = read_sheet_rows(file_path)
+            df_initial = rows_to_dataframe(rows[:HEADER_SAMPLE_ROWS + 1])
         except EmptyDataError:
-            return pd.DataFrame({"Error": ["The uploaded file is empty."]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": ["The uploaded file is empty."]}), gr.update(choices=[]), session
         except Exception as e:
-            return pd.DataFrame({"Error": [f"Failed to read file: {e}"]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": [f"Failed to read file: {e}"]}), gr.update(choices=[]), session
         console.print("Excel file read", style="bold purple")
 
-        # Get header info from Gemini
-        response_data = get_header_info(df_initial)
-        console.print(f"Extracted data: {response_data}", style="bold green")
-        if "error" in response_data.lower() or "fail" in response_data.lower():
-                console.print(f"Error getting initial header info from Gemini: {response_data}", style="bold red")
-                return pd.DataFrame({"Error": [response_data]}), gr.update(choices=[])
-        console.print("Got header info from Gemini", style="bold purple")
-
-        # Safely parse the JSON structure
-        try:
-            json_str = response_data[response_data.find("{"):response_data.rfind("}") + 1].strip()
-            header_info = json.loads(json_str)
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
-            console.print(f"Error parsing Gemini response for header info: {e}", style="bold red")
-            return pd.DataFrame({"Error": [f"Gemini response parsing failed for header info: {e}"]}), gr.update(choices=[])
+        # Get header info from Gemini, reusing the result when the same file is re-submitted
+        file_hash = file_digest(file_path)
+        header_info = get_cached_header_info(file_hash)
+        from_cache = header_info is not None
+        if not from_cache:
+            try:
+                header_info = get_header_info(df_initial)
+            except (RuntimeError, ValueError) as e:
+                console.print(f"Error getting initial header info from Gemini: {e}", style="bold red")
+                return pd.DataFrame({"Error": [str(e)]}), gr.update(choices=[]), session
+            console.print("Got header info from Gemini", style="bold purple")
+        else:
+            console.print("Reusing cached header info for this file", style="bold purple")
 
         header_rows = header_info.get("header rows list", [])
         try:
@@ -68,7 +132,7 @@ def process_file(file_obj, min_percentage):
         except Exception:
             pass
         if not header_rows:
-            return pd.DataFrame({"Error": ["Could not determine header rows from Gemini."]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": ["Could not determine header rows from Gemini."]}), gr.update(choices=[]), session
         console.print(f"Header rows: {header_rows}", style="bold green")
 
         try:
@@ -76,78 +140,75 @@ def process_file(file_obj, min_percentage):
             if not subject_row:
                 subject_row = list(header_info.items())[1][1]
         except Exception: 
-            return pd.DataFrame({"Error": ["Could not determine subject header row from Gemini."]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": ["Could not determine subject header row from Gemini."]}), gr.update(choices=[]), session
             console.print("Could not determine subject header row from Gemini.", style="bold red")
         console.print(f"Subject row: {subject_row}", style="bold green")
         console.print("successfully parsed header information", style="bold purple")
 
-        # Second read with the correct headers
-        df_final = pd.read_excel(file_path, header=[int(h) - 1 for h in header_rows])
-        df_final.columns = [column_rename(col) for col in df_final.columns]
-        df_final = df_final.fillna(0)
-        uploaded_df = df_final
+        # Second frame with the correct headers, from the same parsed rows
+        df_final = rows_to_dataframe(rows, header=[int(h) - 1 for h in header_rows])
+        df_final.columns = rename_columns(df_final.columns)
+        # Fill blanks with 0 only in the columns that have any, instead of copying the whole frame
+        for i in np.flatnonzero(df_final.isna().any().to_numpy()):
+            df_final.isetitem(i, df_final.iloc[:, i].fillna(0))
+        # Class counts are small whole numbers; store them in the narrowest int type
+        for i, dtype in enumerate(df_final.dtypes):
+            if pd.api.types.is_integer_dtype(dtype):
+                df_final.isetitem(i, pd.to_numeric(df_final.iloc[:, i], downcast='integer'))
 
         # Get subject names
         try:
             if subject_row >= 2:
-                subject_names = df_initial.iloc[subject_row-2].dropna().tolist()
+                subject_names = df_initial.iloc[subject_row-2].dropna()
             else:
-                subject_names = df_initial.columns.dropna().tolist()
-            subject_names = [str(s).strip().upper() for s in subject_names if pd.notna(s)]
-            subject_names = [s for s in subject_names if "UNNAMED" not in s]
-            # subject_names = [str(s).strip().upper() for s in df_initial.iloc[subject_row - 2].dropna().tolist() if pd.notna(s)]
+                subject_names = df_initial.columns.dropna()
+            subject_names = subject_names.astype(str).str.strip().str.upper()
+            subject_names = subject_names[~subject_names.str.contains("UNNAMED", regex=False)].tolist()
             if not subject_names:
-                return pd.DataFrame({"Error": ["Could not extract subject names."]}), gr.update(choices=[])
+                return pd.DataFrame({"Error": ["Could not extract subject names."]}), gr.update(choices=[]), session
             subject_names.append("OVERALL")
             console.print(f"Subject Names: {subject_names}", style="bold green")
         except IndexError:
-            return pd.DataFrame({"Error": ["Subject row not found or out of bounds."]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": ["Subject row not found or out of bounds."]}), gr.update(choices=[]), session
         console.print("Obtained subject names", style="bold purple")
 
+        # Only header info that produced a frame and subject names is worth remembering for re-uploads
+        if not from_cache:
+            store_header_info(file_hash, header_info)
+
         # Filter name column and columns representing %
-        sub_table = uploaded_df.filter(regex='(?i)name|%')
-
-        # Normalize % columns such that values are between 1 and 100
-        sub_table = normalize_columns_to_1_100(sub_table)
-        console.print("Filtered percentage columns", style="bold purple")
-        console.print("&"*100)
-        console.print(sub_table)
-        console.print("&"*100)
-
-        # Add an additional colum to compute the overall percentage
-        sub_table, overall_key = add_overall_percentage(sub_table)
-        console.print("Overall percentage column added", style="bold purple")
-        console.print("&"*100)
-        console.print(sub_table)
-        print("&"*100)
+        sub_table = df_final[[c for c in df_final.columns if "name" in c.lower() or "%" in c]]
+
+        # Normalize % columns such that values are between 1 and 100 and add an
+        # additional column with the overall percentage, in one pass
+        try:
+            sub_table, overall_key = normalize_and_add_overall(sub_table)
+        except ValueError as e:
+            console.print(f"Could not compute percentages: {e}", style="bold red")
+            return pd.DataFrame({"Error": [str(e)]}), gr.update(choices=[]), session
+        console.print("Normalized percentage columns and added overall percentage", style="bold purple")
+        log.debug("Normalized table:\n%s", sub_table)
 
         # Summarize attendance
-        response_data_summary, subject_names, status = get_low_attendance_students(sub_table, min_percentage)
-        console.print(f"Response :{response_data_summary}")
+        summarization, subject_names, status = get_low_attendance_students(sub_table, min_percentage, already_normalized=True)
+        log.debug("Response: %s", summarization)
         if status != "success":
             console.print("Summarization failed", style="bold red")
-            return pd.DataFrame({"Error": [response_data_summary]}), gr.update(choices=[])
+            return pd.DataFrame({"Error": [status]}), gr.update(choices=[]), session
         console.print("Obtained final summary of attendance", style="bold purple")
-            
-        # Extract relevant details from the JSON structure
-        try:
-            json_str_summary = response_data_summary[response_data_summary.find("{"):response_data_summary.rfind("}") + 1].strip()
-            summarization = json.loads(json_str_summary)
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
-            console.print(f"Error parsing response from summarization: {e}", style="bold red")
-            return pd.DataFrame({"Error": [f"Response parsing failed for summarization: {e}"]}), gr.update(choices=[])
-        console.print("Successfully parsed final summary of attendance", style="bold purple")
-        print("*"*100)
-
-        return sub_table, gr.update(choices=subject_names, value=subject_names[0] if subject_names else None)
+
+        session = Session(df=df_final, subjects=subject_names, summary=summarization)
+        # Only the top of the table is shown; the full frame stays in the session
+        return sub_table.head(PREVIEW_ROWS), gr.update(choices=subject_names, value=subject_names[0] if subject_names else None), session
     except Exception as e:
         console.print(f"An unexpected error occurred during file processing: {e}", style="bold red")
-        return pd.DataFrame({"Error": ["An unexpected error occurred. Please retry"]}), gr.update(choices=[])
+        return pd.DataFrame({"Error": ["An unexpected error occurred. Please retry"]}), gr.update(choices=[]), session
 
 
-def select(subject):
+def select(subject, session):
     """Displays the list of students for the selected subject."""
 
+    summarization = session.summary
     if not summarization or subject not in summarization:
         return "No information available for this subject."
     if summarization[subject]:
@@ -169,11 +230,12 @@ if __name__ == '__main__':
         gr.Markdown("Enter minimum attendance percentage required")
         percentage_input = gr.Number(label="Minimum attendance percentage required", minimum=1, maximum=100, step=0.1)
 
+        session_state = gr.State(Session())
         process_file_butn = gr.Button("Submit")
         output_preview = gr.DataFrame(label="Excel Preview")
         subject_selector = gr.Dropdown(label="Select subjects", choices=[])
-        process_file_butn.click(fn=process_file, inputs=[file_input, percentage_input], outputs=[output_preview, subject_selector])
+        process_file_butn.click(fn=process_file, inputs=[file_input, percentage_input, session_state], outputs=[output_preview, subject_selector, session_state])
 
         output_textbox = gr.Textbox(label="Students with attendance shortage")
-        subject_selector.change(select, inputs=subject_selector, outputs=output_textbox)
+        subject_selector.change(select, inputs=[subject_selector, session_state], outputs=output_textbox)
     app.launch()